@@ -1,115 +1,171 @@
-import os, requests, json, time
+import requests, json, os, time
+from collections import defaultdict, namedtuple
 from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from getpass import getpass
 from math import radians, cos, sin, asin, sqrt
-from operator import itemgetter
+from operator import attrgetter
 from pathlib import Path
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])))
+SERVERS_CACHE_TTL = 300
+LOCATION_CACHE_TTL = 300
+NAME_TABLE = str.maketrans(' ', '_', '-#<>:"/\\|?*')
+Server = namedtuple('Server', 'name country city station public_key load distance')
+
+def validate_token(token):
+    try:
+        return len(token) == 64 and len(bytes.fromhex(token)) == 32
+    except ValueError:
+        return False
 
 def get_key(token):
-    token = base64.b64encode(f'token:{token}'.encode()).decode()
-    headers = {'Authorization': f'Basic {token}'}
-    response = requests.get("https://api.nordvpn.com/v1/users/services/credentials", headers=headers)
+    response = session.get("https://api.nordvpn.com/v1/users/services/credentials", auth=('token', token), timeout=30)
     response.raise_for_status()
     return response.json().get('nordlynx_private_key')
 
+def get_cached(url, cache_name, ttl):
+    cache = Path('.cache', cache_name)
+    if cache.exists() and time.time() - cache.stat().st_mtime < ttl:
+        try:
+            return json.loads(cache.read_bytes())
+        except ValueError:
+            pass
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    data = json.loads(response.content)
+    cache.parent.mkdir(exist_ok=True)
+    temp = cache.with_name(f'{cache_name}.{os.getpid()}.tmp')
+    temp.write_bytes(response.content)
+    os.replace(temp, cache)
+    return data
+
 def get_servers():
-    return requests.get("https://api.nordvpn.com/v1/servers?limit=7000&filters[servers_technologies][identifier]=wireguard_udp").json()
+    return get_cached("https://api.nordvpn.com/v1/servers?limit=7000&filters[servers_technologies][identifier]=wireguard_udp", 'servers.json', SERVERS_CACHE_TTL)
 
 def format_name(name):
-    return '_'.join(filter(None, name.replace(' ', '_').replace('-', '').split('_')))
-
-def generate_config(key, server):
-    public_key = next((data.get('value') for tech in server['technologies'] if tech['identifier'] == 'wireguard_udp' for data in tech.get('metadata', []) if data.get('name') == 'public_key'), None)
-    if public_key:
-        country_name = format_name(server['locations'][0]['country']['name'])
-        city_name = format_name(server['locations'][0]['country'].get('city', {}).get('name', 'Unknown'))
-        server_name = format_name(f"{server['name'].replace('#', '')}_{city_name}")
-        config = f"""
+    return '_'.join(filter(None, name.translate(NAME_TABLE).split('_')))
+
+@lru_cache(maxsize=None)
+def format_location(name):
+    return format_name(name)
+
+def find_public_key(server):
+    for tech in server['technologies']:
+        if tech['identifier'] == 'wireguard_udp':
+            for data in tech.get('metadata') or ():
+                if data.get('name') == 'public_key':
+                    return data.get('value')
+            return None
+
+def generate_interface(key):
+    return f"""
 [Interface]
 PrivateKey = {key}
 Address = 10.5.0.2/16
 DNS = 103.86.96.100
 
-[Peer]
-PublicKey = {public_key}
+"""
+
+def generate_config(interface, server):
+    if server.public_key:
+        country_name = format_location(server.country)
+        city_name = format_location(server.city)
+        server_name = format_name(f"{server.name}_{city_name}")
+        config = interface + f"""[Peer]
+PublicKey = {server.public_key}
 AllowedIPs = 0.0.0.0/0, ::/0
-Endpoint = {server['station']}:51820
+Endpoint = {server.station}:51820
 PersistentKeepalive = 25
 """
         return country_name, city_name, server_name, config
 
-def save_config(key, server, path=None):
-    if 'locations' in server:
-        config_data = generate_config(key, server)
-        if config_data:
-            country_folder, city_folder, server_name, config = config_data
-            if path is None:
-                path = Path('configs', country_folder, city_folder, f"{server_name}.conf")
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with open(path, "w") as f:
-                f.write(config)
-            return str(path)
-
-def calculate_distance(ulat, ulon, slat, slon):
-    ulon, ulat, slon, slat = map(radians, [ulon, ulat, slon, slat])
+def save_config(path, config):
+    with open(path, "w") as f:
+        f.write(config)
+
+def save_city_configs(folder, configs):
+    folder.mkdir(parents=True, exist_ok=True)
+    for file_name, config in configs:
+        save_config(folder / file_name, config)
+
+def calculate_distance(ulat, ulon, cos_ulat, slat, slon):
+    slat, slon = radians(slat), radians(slon)
     dlon = slon - ulon
     dlat = slat - ulat
-    a = sin(dlat/2)**2 + cos(ulat) * cos(slat) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return c * 6371
+    a = sin(dlat/2)**2 + cos_ulat * cos(slat) * sin(dlon/2)**2
+    return 12742 * asin(sqrt(a))
+
+def parse_servers(servers, ulat, ulon):
+    ulat, ulon = radians(ulat), radians(ulon)
+    cos_ulat = cos(ulat)
+    distances = {}
+    names = set()
+    parsed = []
+    for server in servers:
+        if server['name'] in names:
+            continue
+        names.add(server['name'])
+        location = server['locations'][0]
+        country, city = location['country']['name'], location['country']['city']['name']
+        if (country, city) not in distances:
+            distances[country, city] = calculate_distance(ulat, ulon, cos_ulat, location['latitude'], location['longitude'])
+        parsed.append(Server(server['name'], country, city, server['station'], find_public_key(server), server['load'], distances[country, city]))
+    return parsed
 
 def sort_servers(servers, ulat, ulon):
-    for server in servers:
-        slat = server['locations'][0]['latitude']
-        slon = server['locations'][0]['longitude']
-        server['distance'] = calculate_distance(ulat, ulon, slat, slon)
-    return sorted(servers, key=lambda k: (k['load'], k['distance']))
+    return sorted(parse_servers(servers, ulat, ulon), key=attrgetter('load', 'distance'))
 
 def get_location():
-    location = requests.get('https://ipinfo.io/json').json()['loc'].split(',')
-    return float(location[0]), float(location[1])
+    location = get_cached('https://api.nordvpn.com/v1/helpers/ips/insights', 'location.json', LOCATION_CACHE_TTL)
+    return float(location['latitude']), float(location['longitude'])
 
 def main():
-    token = input("Enter your access token: ")
-    key = get_key(token)
+    token = getpass("Enter your access token: ").strip()
+    if not validate_token(token):
+        print("Invalid access token, expected 64 hexadecimal characters.")
+        return
     start_time = time.time()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = executor.submit(get_key, token), executor.submit(get_servers), executor.submit(get_location)
+    key, servers, (ulat, ulon) = (future.result() for future in futures)
     if key:
-        servers = get_servers()
         if servers:
-            ulat, ulon = get_location()
             sorted_servers = sort_servers(servers, ulat, ulon)
             print("Starting to save configs...")
+            interface = generate_interface(key)
+            configs = {}
+            configs_by_city = {}
+            for server in sorted_servers:
+                config_data = generate_config(interface, server)
+                if not config_data:
+                    continue
+                configs[server.name] = config_data
+                country, city, server_name, config = config_data
+                configs_by_city.setdefault(Path('configs', country, city), []).append((f"{server_name}.conf", config))
             with ThreadPoolExecutor() as executor:
-                paths = list(filter(None, executor.map(save_config, [key]*len(sorted_servers), sorted_servers)))
+                list(executor.map(save_city_configs, configs_by_city.keys(), configs_by_city.values()))
             print("All configs saved.")
 
-            servers_by_location = {}
-            for server in sorted_servers:
-                country = server['locations'][0]['country']['name']
-                city = server['locations'][0]['country']['city']['name']
-                if country not in servers_by_location:
-                    servers_by_location[country] = {}
-                if city not in servers_by_location[country]:
-                    servers_by_location[country][city] = {"distance": int(server['distance']), "servers": []}
-                server_info = (server['name'], f"load: {server['load']}")
-                servers_by_location[country][city]["servers"].append(server_info)
-
-            for country in servers_by_location:
-                for city in servers_by_location[country]:
-                    servers_by_location[country][city]["servers"].sort(key=itemgetter(1))
-
+            servers_by_location = defaultdict(dict)
             Path('best_configs').mkdir(parents=True, exist_ok=True)
-            for country, cities in servers_by_location.items():
-                safe_country_name = format_name(country)
-                for city, data in cities.items():
-                    best_server = data["servers"][0]
-                    best_server_info = next(server for server in servers if server['name'] == best_server[0])
-                    save_config(key, best_server_info, Path('best_configs', f'{safe_country_name}_{format_name(city)}.conf'))
+            for server in sorted_servers:
+                cities = servers_by_location[server.country]
+                if server.city not in cities:
+                    cities[server.city] = {"distance": int(server.distance), "servers": []}
+                    if server.name in configs:
+                        country, city, _, config = configs[server.name]
+                        save_config(Path('best_configs', f'{country}_{city}.conf'), config)
+                server_info = (server.name, f"load: {server.load}")
+                cities[server.city]["servers"].append(server_info)
 
             servers_by_location = dict(sorted(servers_by_location.items()))
 
             with open('servers.json', 'w') as f:
-                json.dump(servers_by_location, f, indent=2)
+                f.write(json.dumps(servers_by_location, indent=2))
 
         else:
             print("Failed to retrieve server information.")